@@ -1,15 +1,34 @@
 import os
-import json
-import requests
+import asyncio
+import threading
+from collections import OrderedDict
+import httpx
+import orjson
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 from dotenv import load_dotenv
 from typing import List, Dict
 
+
+class OrjsonProvider(JSONProvider):
+    """
+    Flask JSON provider backed by orjson for faster request parsing and jsonify.
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 # --- CONFIGURATION ---
 load_dotenv()
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
-OR_API_KEY = os.getenv("OPENROUTER_API_KEY", "<YOUR_OPENROUTER_KEY>")
+# Left empty when unset so the AI expansion is skipped instead of sending a placeholder key
+OR_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 OR_CHAT_URL = "https://openrouter.ai/api/v1/chat/completions"
 # Using a powerful free model that's good at instruction following
 AI_MODEL = "mistralai/mistral-7b-instruct:free"
@@ -19,49 +38,157 @@ HEADERS = {
     "Content-Type": "application/json"
 }
 
+# Cap on in-flight OpenRouter requests to stay within rate limits
+MAX_CONCURRENT_AI_CALLS = 8
+
+# Long-lived event loop + pooled client so OpenRouter connections stay alive across requests.
+# Created lazily (not at import) so every gunicorn worker builds its own after forking.
+_ai_loop = None
+_ai_loop_lock = threading.Lock()
+_ai_client = None
+_ai_semaphore = None
+
+# LRU of AI expansions keyed by (category, sorted base keywords). Only touched from the AI loop.
+AI_CACHE_MAXSIZE = 2048
+_ai_cache = OrderedDict()
+
+
+def _get_ai_loop() -> asyncio.AbstractEventLoop:
+    global _ai_loop
+    with _ai_loop_lock:
+        if _ai_loop is None:
+            _ai_loop = asyncio.new_event_loop()
+            threading.Thread(target=_ai_loop.run_forever, name="openrouter-loop", daemon=True).start()
+    return _ai_loop
+
+
+def _get_ai_client() -> httpx.AsyncClient:
+    # Only ever called from the background loop, so no locking is needed here
+    global _ai_client, _ai_semaphore
+    if _ai_client is None:
+        _ai_client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=90,
+            limits=httpx.Limits(max_keepalive_connections=MAX_CONCURRENT_AI_CALLS),
+        )
+        _ai_semaphore = asyncio.Semaphore(MAX_CONCURRENT_AI_CALLS)
+    return _ai_client
+
+
+def run_on_ai_loop(coro):
+    """
+    Runs a coroutine on the shared OpenRouter event loop and blocks until it finishes.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_ai_loop()).result()
+
+
+# Static parts of the expansion prompt, built once; only the category blocks change per call
+AI_PROMPT_PREFIX = (
+    "You are an expert keyword generator for a news feed. Your task is to expand on lists of user-provided keywords, one list per category. "
+    "For each category below and its base keywords, generate a list of up to 3 additional, highly relevant keywords. \n\n"
+    "RULES:\n"
+    "1. Each keyword MUST be short and concise (1 to 3 words maximum).\n"
+    "2. Do NOT generate long sentences or descriptive phrases.\n"
+    "3. The keywords should be specific sub-topics, technologies, or named entities related to the base keywords.\n"
+    "4. Respond ONLY with a valid JSON object mapping each category name to a list of strings.\n\n"
+)
+AI_PROMPT_SUFFIX = (
+    "\n"
+    "Example of good output for Category \"Finance\" with Base Keywords ['Stock Markets', 'Venture Capital']:\n"
+    "{\"Finance\": [\"IPO\", \"Angel Investors\", \"Market Analysis\"]}\n\n"
+    "Example of BAD output:\n"
+    "{\"Finance\": [\"The impact of interest rates on stock market performance\", \"Venture capital funding rounds for tech startups\"]}"
+)
+AI_PAYLOAD_BASE = {"model": AI_MODEL, "stream": True}
+
 
 # --- MAPPINGS & LOGIC ---
 
-def get_ai_expanded_keywords_for_category(base_keywords: list, category: str) -> list:
+def _clean_ai_content(content_str: str) -> str:
+    # Clean potential markdown wrapping
+    cleaned_str = content_str.strip()
+    if cleaned_str.startswith("```json"):
+        cleaned_str = cleaned_str.replace("```json", "").replace("```", "").strip()
+    return cleaned_str
+
+
+async def get_ai_expanded_keywords(client: httpx.AsyncClient, grouped_keywords: Dict[str, List[str]]) -> Dict[str, list]:
     """
-    Uses OpenRouter to get semantically related keywords FOR A SPECIFIC CATEGORY.
+    Uses a single OpenRouter call to get semantically related keywords FOR EVERY CATEGORY at once.
     """
-    if not base_keywords or not OR_API_KEY:
-        return []
-
-    # Craft a more specific, category-aware prompt
-    prompt = (
-        "You are an expert keyword generator for a news feed. Your task is to expand on a list of user-provided keywords for a specific category. "
-        "For the given category and base keywords, generate a list of up to 3 additional, highly relevant keywords. \n\n"
-        "RULES:\n"
-        "1. Each keyword MUST be short and concise (1 to 3 words maximum).\n"
-        "2. Do NOT generate long sentences or descriptive phrases.\n"
-        "3. The keywords should be specific sub-topics, technologies, or named entities related to the base keywords.\n"
-        "4. Respond ONLY with a valid JSON list of strings.\n\n"
-        f"Category: \"{category}\"\n"
-        f"Base Keywords: {', '.join(base_keywords)}\n\n"
-        "Example of good output for Base Keywords ['Stock Markets', 'Venture Capital']:\n"
-        "[\"IPO\", \"Angel Investors\", \"Market Analysis\"]\n\n"
-        "Example of BAD output:\n"
-        "[\"The impact of interest rates on stock market performance\", \"Venture capital funding rounds for tech startups\"]"
+    if not grouped_keywords or not OR_API_KEY:
+        return {}
+
+    # One block per category so the model can keep each expansion on-topic
+    category_blocks = "\n".join(
+        f"Category: \"{category}\"\nBase Keywords: {', '.join(base_keywords)}\n"
+        for category, base_keywords in grouped_keywords.items()
     )
 
-    payload = {"model": AI_MODEL, "messages": [{"role": "user", "content": prompt}]}
+    prompt = AI_PROMPT_PREFIX + category_blocks + AI_PROMPT_SUFFIX
+    payload = {**AI_PAYLOAD_BASE, "messages": [{"role": "user", "content": prompt}]}
 
     try:
-        response = requests.post(OR_CHAT_URL, headers=HEADERS, json=payload, timeout=90)
-        response.raise_for_status()
-        content_str = response.json()["choices"][0]["message"]["content"]
-        
-        # Clean potential markdown wrapping
-        cleaned_str = content_str.strip()
-        if cleaned_str.startswith("```json"):
-            cleaned_str = cleaned_str.replace("```json", "").replace("```", "").strip()
-        
-        return json.loads(cleaned_str)
+        content_str = ""
+        expanded = None
+        async with client.stream("POST", OR_CHAT_URL, content=orjson.dumps(payload)) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue # SSE comments / keep-alive pings
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                delta = orjson.loads(data)["choices"][0].get("delta", {}).get("content")
+                if not delta:
+                    continue
+                content_str += delta
+
+                # Stop reading as soon as the JSON object is complete
+                if "}" in delta:
+                    try:
+                        expanded = orjson.loads(_clean_ai_content(content_str))
+                        break
+                    except ValueError:
+                        pass
+
+        if expanded is None:
+            expanded = orjson.loads(_clean_ai_content(content_str))
+        # Ignore anything the model invents beyond the categories we asked about
+        return {category: list(expanded[category]) for category in grouped_keywords if category in expanded}
     except Exception as e:
-        print(f"Error calling OpenRouter for category {category}: {e}")
-        return []
+        print(f"Error calling OpenRouter for categories {list(grouped_keywords)}: {e}")
+        return {}
+
+
+async def expand_grouped_keywords(grouped_keywords: Dict[str, List[str]]) -> Dict[str, list]:
+    """
+    Expands every non-empty category, serving cached categories locally and batching the rest into one AI call.
+    """
+    expanded = {}
+    pending = {}
+    for category_name, base_keywords in grouped_keywords.items():
+        if not base_keywords: # Only call AI if there are keywords for the category
+            continue
+        cache_key = (category_name, tuple(sorted(base_keywords)))
+        if cache_key in _ai_cache:
+            _ai_cache.move_to_end(cache_key)
+            expanded[category_name] = list(_ai_cache[cache_key])
+        else:
+            pending[category_name] = base_keywords
+
+    if pending:
+        print(f"Expanding keywords for categories: {', '.join(pending)}...")
+        client = _get_ai_client()
+        async with _ai_semaphore:
+            fresh = await get_ai_expanded_keywords(client, pending)
+        for category_name, keywords in fresh.items():
+            _ai_cache[(category_name, tuple(sorted(pending[category_name])))] = keywords
+            if len(_ai_cache) > AI_CACHE_MAXSIZE:
+                _ai_cache.popitem(last=False)
+            expanded[category_name] = list(keywords)
+
+    return expanded
 
 
 def process_survey_to_preferences(survey_data: dict) -> dict:
@@ -114,12 +241,11 @@ def process_survey_to_preferences(survey_data: dict) -> dict:
     # --- Step 2: AI Expansion FOR EACH Category ---
     
     all_ai_keywords = []
-    for category_name, base_keywords in grouped_keywords.items():
-        if base_keywords: # Only call AI if there are keywords for the category
-            print(f"Expanding keywords for category: {category_name}...")
-            expanded = get_ai_expanded_keywords_for_category(base_keywords, category_name)
+    # Skip the AI loop entirely when there is nothing to expand or no key to expand with
+    if OR_API_KEY and any(grouped_keywords.values()):
+        for category_name, expanded in run_on_ai_loop(expand_grouped_keywords(grouped_keywords)).items():
             all_ai_keywords.extend(expanded)
-            print(f"  > AI suggested: {expanded}")
+            print(f"  > AI suggested for {category_name}: {expanded}")
 
     # Add the AI-generated keywords with a consistent, moderate weight
     for kw in all_ai_keywords:
@@ -143,6 +269,9 @@ def generate_preferences_endpoint():
     except:
         return jsonify({"error": "Invalid JSON input"}), 400
 
+    if not survey:
+        return jsonify({"keywords": []})
+
     prefs = process_survey_to_preferences(survey)
     return jsonify(prefs)
 